@@ -5,20 +5,27 @@ Scrapes all products, generates image embeddings, and imports to Supabase
 """
 
 import json
+import orjson
 import asyncio
 import aiohttp
+import hashlib
 import os
-from typing import List, Dict, Any, Optional
+import re
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator, Optional
 from dataclasses import dataclass
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import logging
 from urllib.parse import urljoin
 
 # Third-party imports
+import diskcache
+import numpy as np
 import torch
-from transformers import AutoProcessor, AutoModel
+from torch.utils.data import DataLoader, Dataset
+from torchvision.transforms import v2 as transforms
+from transformers import AutoModel
 from PIL import Image
-import requests
 from io import BytesIO
 from supabase import create_client, Client
 from playwright.async_api import async_playwright, Browser, Page
@@ -31,6 +38,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Single-pass keyword scan over a product's lowercased category list,
+# covering both gender detection and material tags. COS categories are
+# concatenated slugs like "men_menmenswearknitwearcashmere" with no
+# separators around keywords, so these must be substring matches; the
+# lookbehind keeps "women..." slugs from counting as men's
+_KEYWORD_PATTERN = re.compile(r"cashmere|wool|cotton|(?<!wo)men")
+
+
+def _chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    """Yield lists of up to `size` items from an iterable"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
 @dataclass
 class ProductData:
     """Structured product data matching Supabase schema"""
@@ -54,164 +75,450 @@ class ProductData:
     compressed_image_url: Optional[str] = None
     tags: Optional[List[str]] = None
 
+class ImageBytesDataset(Dataset):
+    """Decode + transform downloaded image bytes in DataLoader workers.
+
+    Returns (tensor, ok) pairs; a decode failure yields a zero tensor with
+    ok=False so batch shapes stay uniform and the caller can discard it.
+    """
+
+    def __init__(self, blobs: List[bytes], transform, dtype: torch.dtype):
+        self.blobs = blobs
+        self.transform = transform
+        self.dtype = dtype
+
+    def __len__(self):
+        return len(self.blobs)
+
+    def __getitem__(self, index):
+        try:
+            image = Image.open(BytesIO(self.blobs[index])).convert("RGB")
+            return self.transform(image), True
+        except Exception as e:
+            logger.error(f"Failed to decode image at index {index}: {e}")
+            return torch.zeros(3, 384, 384, dtype=self.dtype), False
+
+
 class COSEmbeddingGenerator:
     """Generate 768-dim embeddings using google/siglip-base-patch16-384"""
 
     def __init__(self):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Using device: {self.device}")
+        # fp16 saturates tensor cores on CUDA; bf16 hits the fast AVX-512/AMX
+        # paths on recent CPUs
+        self.dtype = torch.float16 if self.device == "cuda" else torch.bfloat16
+        logger.info(f"Using device: {self.device} ({self.dtype})")
 
-        # Load model and processor - exactly Siglip as requested
-        self.processor = AutoProcessor.from_pretrained("google/siglip-base-patch16-384")
+        # Input shape is a fixed 384x384, so let cuDNN benchmark once and
+        # reuse the best kernels, and allow TF32 matmul paths
+        torch.backends.cudnn.benchmark = True
+        torch.set_float32_matmul_precision("high")
+
+        # On-disk embedding cache keyed by image URL - COS reuses the same
+        # image across category listings, and reruns hit it for free
+        self.cache = diskcache.Cache("./.emb_cache")
+
+        # Load model - exactly Siglip as requested
         self.model = AutoModel.from_pretrained("google/siglip-base-patch16-384")
-        self.model.to(self.device)
         self.model.eval()
 
-    def generate_embedding(self, image_url: str) -> Optional[List[float]]:
-        """Generate embedding from image URL using Siglip model"""
+        # Backend preference: shape-specialized TensorRT engine (CUDA only),
+        # then the INT8 ONNX Runtime vision tower, then torch.compile
+        self.trt_module = self._try_init_tensorrt() if self.device == "cuda" else None
+        self.onnx_session = self._try_init_onnx() if self.trt_module is None else None
+        if self.onnx_session is not None:
+            # ONNX graph takes float32 inputs and replaces the torch forward
+            self.dtype = torch.float32
+
+        # Replicate the SigLIP processor (resize to 384x384, scale to [0,1],
+        # normalize with mean/std 0.5) as a plain torchvision pipeline - this
+        # avoids the processor's Python overhead and the dummy-text tokenize
+        self.transform = transforms.Compose([
+            transforms.ToImage(),
+            transforms.Resize((384, 384), antialias=True),
+            transforms.ToDtype(self.dtype, scale=True),
+            transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
+        ])
+
+        if self.trt_module is None and self.onnx_session is None:
+            self.model.to(self.device, dtype=self.dtype)
+            # Inductor failures usually surface on the warm-up forward, not
+            # at compile() - keep the eager module so the fallback is real
+            eager_vision_model = self.model.vision_model
+            try:
+                # Only the vision tower runs, so that's what gets compiled
+                self.model.vision_model = torch.compile(
+                    eager_vision_model, mode="reduce-overhead", fullgraph=False
+                )
+                self._warm_up()
+            except Exception as e:
+                self.model.vision_model = eager_vision_model
+                logger.warning(f"torch.compile unavailable, running eager: {e}")
+
+    TRT_MODULE_PATH = ".siglip_vision.trt.ts"
+
+    def _try_init_tensorrt(self) -> Optional[Any]:
+        """Load (building + caching once) a TensorRT engine for the vision tower.
+
+        Inputs are always BATCH_SIZE x 3 x 384 x 384 fp16 after padding, so
+        the engine is specialized for exactly that shape. Returns None when
+        torch-tensorrt is not installed or compilation fails.
+        """
         try:
-            # Download image
-            response = requests.get(image_url, timeout=10)
-            response.raise_for_status()
-
-            # Open image
-            image = Image.open(BytesIO(response.content)).convert("RGB")
-
-            # Process image with dummy text (SigLIP requires both image and text)
-            inputs = self.processor(
-                images=image,
-                text=["a photo of a fashion item"],  # Dummy text input
-                return_tensors="pt",
-                padding=True
+            import torch_tensorrt
+        except ImportError:
+            return None
+
+        try:
+            if os.path.exists(self.TRT_MODULE_PATH):
+                module = torch.jit.load(self.TRT_MODULE_PATH).to(self.device)
+                logger.info("Loaded cached TensorRT vision engine")
+                return module
+
+            logger.info("Building TensorRT vision engine (one-time)...")
+            vision = self.model.vision_model.to(self.device, dtype=torch.float16)
+            module = torch_tensorrt.compile(
+                vision,
+                inputs=[torch_tensorrt.Input((self.BATCH_SIZE, 3, 384, 384), dtype=torch.float16)],
+                enabled_precisions={torch.float16},
             )
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            torch.jit.save(module, self.TRT_MODULE_PATH)
+            return module
+        except Exception as e:
+            logger.warning(f"TensorRT vision engine unavailable: {e}")
+            return None
+
+    ONNX_MODEL_PATH = ".siglip_vision.int8.onnx"
+
+    def _try_init_onnx(self) -> Optional[Any]:
+        """Load (exporting + quantizing once) the INT8 ONNX vision tower.
 
-            # Generate embedding
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                # For SigLIP, use the image embeddings (vision outputs)
-                embedding = outputs.image_embeds.squeeze().cpu().numpy()
+        Returns None when onnxruntime is not installed or the export fails,
+        in which case the PyTorch path is used.
+        """
+        try:
+            import onnxruntime
+        except ImportError:
+            return None
 
-            return embedding.tolist()
+        # On a CUDA host, a missing CUDA EP would make onnxruntime silently
+        # fall back to a CPU session - worse than the torch CUDA path, so
+        # prefer torch instead
+        if self.device == "cuda" and \
+                "CUDAExecutionProvider" not in onnxruntime.get_available_providers():
+            logger.info("onnxruntime has no CUDA provider, using the torch CUDA path")
+            return None
 
+        try:
+            if not os.path.exists(self.ONNX_MODEL_PATH):
+                self._export_onnx()
+
+            providers = ["CPUExecutionProvider"]
+            if self.device == "cuda":
+                providers.insert(0, "CUDAExecutionProvider")
+            session = onnxruntime.InferenceSession(self.ONNX_MODEL_PATH, providers=providers)
+            logger.info("Using INT8 ONNX Runtime session for the vision tower")
+            return session
         except Exception as e:
-            logger.error(f"Failed to generate embedding for {image_url}: {e}")
+            logger.warning(f"ONNX vision tower unavailable, using PyTorch: {e}")
             return None
 
-class COSDataProcessor:
-    """Process COS JSON data into structured ProductData"""
+    def _export_onnx(self):
+        """One-time export of the fp32 vision tower to ONNX + dynamic INT8 quantization"""
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        fp32_path = self.ONNX_MODEL_PATH.replace(".int8.", ".fp32.")
+        logger.info("Exporting SigLIP vision tower to ONNX (one-time)...")
+        torch.onnx.export(
+            self.model.vision_model,
+            (torch.zeros(1, 3, 384, 384),),
+            fp32_path,
+            input_names=["pixel_values"],
+            output_names=["last_hidden_state", "pooler_output"],
+            dynamic_axes={"pixel_values": {0: "batch"}},
+            opset_version=17,
+        )
+        quantize_dynamic(fp32_path, self.ONNX_MODEL_PATH, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
 
-    def __init__(self):
-        self.embedding_generator = COSEmbeddingGenerator()
+    def _warm_up(self):
+        """Trigger compilation once on a dummy input so the first real batch is fast"""
+        dummy = self.transform(Image.new("RGB", (384, 384))).unsqueeze(0).to(self.device)
+        with torch.inference_mode(), torch.autocast(self.device, dtype=self.dtype):
+            self.model.get_image_features(pixel_values=dummy)
 
-    def process_product(self, product_json: Dict[str, Any]) -> Optional[ProductData]:
-        """Process a single product from COS JSON"""
-        try:
-            # Extract basic info
-            product_id = product_json.get("id", "")
-            if not product_id:
-                return None
+    BATCH_SIZE = 32
 
-            # Build product URL
-            uri = product_json.get("uri", "")
-            product_url = f"https://www.cos.com/en-eu/{uri}" if uri else ""
+    def generate_embedding(self, image_url: str) -> Optional[List[float]]:
+        """Generate embedding for a single image URL (convenience wrapper)"""
+        return self.generate_embeddings([image_url])[0]
+
+    def generate_embeddings(self, image_urls: List[str]) -> List[Optional[List[float]]]:
+        """Generate embeddings for a list of image URLs in batched forward passes.
+
+        Returns one entry per input URL (None where download or inference failed),
+        so callers can assign results back by index.
+        """
+        embeddings: List[Optional[List[float]]] = [None] * len(image_urls)
+
+        # Serve cache hits first; only cache misses go through download + model
+        pending_urls = []
+        pending_indices = []
+        for i, image_url in enumerate(image_urls):
+            cached = self.cache.get(self._cache_key(image_url))
+            if cached is not None:
+                embeddings[i] = np.frombuffer(cached, dtype=np.float32).tolist()
+            else:
+                pending_urls.append(image_url)
+                pending_indices.append(i)
+
+        if len(pending_urls) < len(image_urls):
+            logger.info(f"Embedding cache hit for {len(image_urls) - len(pending_urls)} "
+                        f"of {len(image_urls)} images")
+
+        # Download all uncached image bytes concurrently, keeping track of
+        # which original index each belongs to
+        downloaded = self._download_images(pending_urls)
+        blobs = []
+        indices = []
+        for i, blob in enumerate(downloaded):
+            if blob is not None:
+                blobs.append(blob)
+                indices.append(pending_indices[i])
+
+        if not blobs:
+            return embeddings
+
+        # Decode + resize/normalize in DataLoader workers so CPU
+        # preprocessing overlaps the GPU forward; only image_embeds is ever
+        # read, so the text tower is skipped entirely via get_image_features
+        dataset = ImageBytesDataset(blobs, self.transform, self.dtype)
+        num_workers = min(8, os.cpu_count() or 1)
+        loader = DataLoader(
+            dataset,
+            batch_size=self.BATCH_SIZE,
+            num_workers=num_workers,
+            pin_memory=(self.device == "cuda"),
+            prefetch_factor=4 if num_workers else None,
+        )
 
-            # Get primary image
-            primary_image = product_json.get("primaryImage", {})
-            image_url = primary_image.get("src", "")
+        position = 0
+        for batch, ok in loader:
+            try:
+                batch_embeddings = self._forward_batch(batch)
 
-            if not image_url:
-                # Fallback to first image in images array
-                images = product_json.get("images", [])
-                if images:
-                    image_url = images[0].get("src", "")
+                for j, embedding in enumerate(batch_embeddings):
+                    if ok[j]:
+                        index = indices[position + j]
+                        embeddings[index] = embedding.tolist()
+                        # Store compact float32 bytes for future runs
+                        self.cache[self._cache_key(image_urls[index])] = \
+                            np.asarray(embedding, dtype=np.float32).tobytes()
 
-            if not image_url:
-                logger.warning(f"No image found for product {product_id}")
+            except Exception as e:
+                logger.error(f"Failed to generate embeddings for batch starting at {position}: {e}")
+            position += len(ok)
+
+        return embeddings
+
+    @staticmethod
+    def _cache_key(image_url: str) -> str:
+        return hashlib.sha1(image_url.encode()).hexdigest()
+
+    def _forward_batch(self, batch: torch.Tensor):
+        """Run one pixel batch through whichever vision backend is active"""
+        if self.trt_module is not None:
+            batch = batch.to(self.device, non_blocking=True)
+            n = batch.shape[0]
+            if n < self.BATCH_SIZE:
+                # The engine only accepts full batches; pad and slice back
+                pad = torch.zeros(self.BATCH_SIZE - n, 3, 384, 384,
+                                  dtype=batch.dtype, device=batch.device)
+                batch = torch.cat([batch, pad])
+            with torch.inference_mode():
+                outputs = self.trt_module(batch)
+            # Output 1 is pooler_output, i.e. the SigLIP image embeddings
+            return outputs[1][:n].float().cpu().numpy()
+
+        if self.onnx_session is not None:
+            # Output 1 is pooler_output, i.e. the SigLIP image embeddings
+            return self.onnx_session.run(None, {"pixel_values": batch.numpy()})[1]
+
+        batch = batch.to(self.device, non_blocking=True)
+        with torch.inference_mode(), torch.autocast(self.device, dtype=self.dtype):
+            return self.model.get_image_features(pixel_values=batch).float().cpu().numpy()
+
+    def _download_images(self, image_urls: List[str]) -> List[Optional[bytes]]:
+        """Download all images concurrently over a single pooled session"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._gather_images(image_urls))
+
+        # Already inside an event loop (e.g. the browser scraper) - run the
+        # download loop on its own loop in a worker thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self._gather_images(image_urls)).result()
+
+    async def _gather_images(self, image_urls: List[str]) -> List[Optional[bytes]]:
+        """Fetch all image URLs with bounded concurrency on one keep-alive session"""
+        semaphore = asyncio.Semaphore(32)
+        connector = aiohttp.TCPConnector(limit=32, limit_per_host=16)
+        timeout = aiohttp.ClientTimeout(total=10)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = [self._fetch_image(session, semaphore, url) for url in image_urls]
+            return await asyncio.gather(*tasks)
+
+    async def _fetch_image(self, session: aiohttp.ClientSession,
+                           semaphore: asyncio.Semaphore, image_url: str) -> Optional[bytes]:
+        """Download a single image's raw bytes (decoding happens in DataLoader workers)"""
+        async with semaphore:
+            try:
+                async with session.get(image_url) as response:
+                    response.raise_for_status()
+                    return await response.read()
+            except Exception as e:
+                logger.error(f"Failed to download image {image_url}: {e}")
                 return None
 
-            # Extract title
-            title = product_json.get("name", "").strip()
-            if not title:
-                return None
+def _process_meta(product_json: Dict[str, Any]) -> Optional[ProductData]:
+    """Build a ProductData (no embedding) from one COS JSON item.
 
-            # Determine gender
-            categories = product_json.get("categories", [])
-            gender = "WOMAN"  # default
-            if any("men" in cat.lower() for cat in categories):
-                gender = "MAN"
+    Module-level so ProcessPoolExecutor workers can pickle it.
+    """
+    try:
+        # Bind the lookup once; every field below goes through it
+        get = product_json.get
 
-            # Extract price
-            price_str = product_json.get("price", "").replace("€", "").replace(",", ".").strip()
-            try:
-                price = float(price_str)
-            except (ValueError, TypeError):
-                price = 0.0
-
-            # Extract category (simplified)
-            category = None
-            category_uri = product_json.get("categoryUri", "")
-            if "/" in category_uri:
-                category = category_uri.split("/")[-1].replace("-", " ").title()
-
-            # Create metadata JSON
-            metadata = {
-                "centra_product_id": product_json.get("centraProductId"),
-                "sku": product_json.get("sku"),
-                "product_sku": product_json.get("product_sku"),
-                "variants_count": product_json.get("variantsCount"),
-                "is_new": product_json.get("isNew", False),
-                "is_on_sale": product_json.get("isOnSale", False),
-                "categories": categories,
-                "sustainability_composition": product_json.get("sustainabilityComposition", []),
-                "all_images": [img.get("src") for img in product_json.get("images", []) if img.get("src")]
-            }
-
-            # Generate embedding
-            logger.info(f"Generating embedding for product {product_id}: {title}")
-            embedding = self.embedding_generator.generate_embedding(image_url)
-
-            # Create tags from categories (simplified)
-            tags = []
-            for cat in categories:
-                if "cashmere" in cat.lower():
-                    tags.append("cashmere")
-                elif "wool" in cat.lower():
-                    tags.append("wool")
-                elif "cotton" in cat.lower():
-                    tags.append("cotton")
-
-            return ProductData(
-                id=f"cos_{product_id}",
-                product_url=product_url,
-                image_url=image_url,
-                title=title,
-                gender=gender,
-                price=price,
-                currency="EUR",
-                category=category,
-                metadata=json.dumps(metadata),
-                embedding=embedding,
-                tags=tags if tags else None
-            )
+        # Validate everything that can reject the product up front, so
+        # no URL/metadata work (or a later embedding) is spent on rejects
+        product_id = get("id", "")
+        if not product_id:
+            return None
 
-        except Exception as e:
-            logger.error(f"Failed to process product {product_json.get('id', 'unknown')}: {e}")
+        title = get("name", "").strip()
+        if not title:
+            return None
+
+        # Get primary image, falling back to the first of the images array
+        images = get("images") or []
+        image_url = (get("primaryImage") or {}).get("src", "")
+        if not image_url and images:
+            image_url = images[0].get("src", "")
+
+        if not image_url:
+            logger.warning(f"No image found for product {product_id}")
             return None
 
-    def process_json_response(self, json_data: Dict[str, Any]) -> List[ProductData]:
-        """Process complete JSON response with products"""
-        products = []
+        # Build product URL
+        uri = get("uri", "")
+        product_url = f"https://www.cos.com/en-eu/{uri}" if uri else ""
+
+        # Scan the categories once for gender and material keywords
+        categories = get("categories", [])
+        keywords = {m.group(0) for m in _KEYWORD_PATTERN.finditer(" ".join(categories).lower())}
+        gender = "MAN" if "men" in keywords else "WOMAN"
+
+        # Extract price
+        price_str = get("price", "").replace("€", "").replace(",", ".").strip()
+        try:
+            price = float(price_str)
+        except (ValueError, TypeError):
+            price = 0.0
+
+        # Extract category (simplified)
+        category = None
+        category_uri = get("categoryUri", "")
+        if "/" in category_uri:
+            category = category_uri.split("/")[-1].replace("-", " ").title()
+
+        # Create metadata JSON, reusing the images list fetched above
+        metadata = {
+            "centra_product_id": get("centraProductId"),
+            "sku": get("sku"),
+            "product_sku": get("product_sku"),
+            "variants_count": get("variantsCount"),
+            "is_new": get("isNew", False),
+            "is_on_sale": get("isOnSale", False),
+            "categories": categories,
+            "sustainability_composition": get("sustainabilityComposition", []),
+            "all_images": [img["src"] for img in images if img.get("src")]
+        }
+
+        # Create tags from the material keywords (simplified)
+        tags = sorted(keywords - {"men"})
+
+        return ProductData(
+            id=f"cos_{product_id}",
+            product_url=product_url,
+            image_url=image_url,
+            title=title,
+            gender=gender,
+            price=price,
+            currency="EUR",
+            category=category,
+            metadata=orjson.dumps(metadata).decode(),
+            tags=tags if tags else None
+        )
+
+    except Exception as e:
+        logger.error(f"Failed to process product {product_json.get('id', 'unknown')}: {e}")
+        return None
+
+
+class COSDataProcessor:
+    """Process COS JSON data into structured ProductData"""
+
+    # Below this many items the process pool costs more than it saves
+    POOL_THRESHOLD = 256
+
+    def __init__(self):
+        self.embedding_generator = COSEmbeddingGenerator()
+
+    def process_product(self, product_json: Dict[str, Any]) -> Optional[ProductData]:
+        """Process a single product from COS JSON (embedding attached separately)"""
+        return _process_meta(product_json)
 
-        # Extract items array
+    def iter_products(self, json_data: Dict[str, Any]) -> Iterator[ProductData]:
+        """Lazily yield ProductData (without embeddings) from a JSON response.
+
+        Large catalogs fan the pure-Python munging out across CPU cores;
+        results stream out in input order either way.
+        """
         items = json_data.get("items", [])
         logger.info(f"Processing {len(items)} products from JSON")
 
-        for item in items:
-            product = self.process_product(item)
-            if product:
-                products.append(product)
-
+        if len(items) >= self.POOL_THRESHOLD:
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+                yield from (p for p in pool.map(_process_meta, items, chunksize=64) if p)
+        else:
+            yield from (p for p in map(_process_meta, items) if p)
+
+    def attach_embeddings(self, products: List[ProductData],
+                          existing: Optional[Dict[str, str]] = None):
+        """Batch-embed the products that are new or whose image changed.
+
+        `existing` maps already-ingested product ids to their stored image URL;
+        products whose image is unchanged keep embedding=None so the upsert
+        leaves the stored embedding untouched.
+        """
+        existing = existing or {}
+        to_embed = [p for p in products if existing.get(p.id) != p.image_url]
+        if to_embed:
+            logger.info(f"Generating embeddings for {len(to_embed)} of {len(products)} products "
+                        f"({len(products) - len(to_embed)} already ingested)")
+            embeddings = self.embedding_generator.generate_embeddings(
+                [product.image_url for product in to_embed]
+            )
+            for product, embedding in zip(to_embed, embeddings):
+                product.embedding = embedding
+
+    def process_json_response(self, json_data: Dict[str, Any],
+                              existing: Optional[Dict[str, str]] = None) -> List[ProductData]:
+        """Process complete JSON response with products (fully materialized)"""
+        products = list(self.iter_products(json_data))
+        self.attach_embeddings(products, existing)
         return products
 
 class SupabaseImporter:
@@ -220,37 +527,75 @@ class SupabaseImporter:
     def __init__(self, url: str, key: str):
         self.client: Client = create_client(url, key)
 
+    CHUNK_SIZE = 1000
+
+    def fetch_existing(self, ids: List[str]) -> Dict[str, str]:
+        """Return {id: image_url} for the given ids that already have an embedding.
+
+        Rows whose embedding is NULL (e.g. the image download failed on a
+        previous run) are excluded on purpose so they get re-embedded.
+        """
+        existing: Dict[str, str] = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            try:
+                response = self.client.table("products").select("id,image_url") \
+                    .in_("id", chunk).not_.is_("embedding", "null").execute()
+                for row in response.data or []:
+                    existing[row["id"]] = row.get("image_url")
+            except Exception as e:
+                logger.warning(f"Failed to fetch existing products: {e}")
+        return existing
+
     def import_products(self, products: List[ProductData]) -> Dict[str, int]:
-        """Import products to Supabase with upsert logic"""
+        """Import products to Supabase with chunked bulk upserts"""
         results = {"inserted": 0, "updated": 0, "errors": 0}
 
-        for product in products:
-            try:
-                # Convert to dict for Supabase
-                product_dict = {
-                    "id": product.id,
-                    "source": product.source,
-                    "product_url": product.product_url,
-                    "affiliate_url": product.affiliate_url,
-                    "image_url": product.image_url,
-                    "brand": product.brand,
-                    "title": product.title,
-                    "description": product.description,
-                    "category": product.category,
-                    "gender": product.gender,
-                    "price": product.price,
-                    "currency": product.currency,
-                    "metadata": product.metadata,
-                    "size": product.size,
-                    "second_hand": product.second_hand,
-                    "embedding": product.embedding,
-                    "country": product.country,
-                    "compressed_image_url": product.compressed_image_url,
-                    "tags": product.tags,
-                    "created_at": datetime.utcnow().isoformat()
-                }
+        product_dicts = self._products_to_dicts(products)
+
+        # PostgREST bulk payloads need uniform keys, so rows without an
+        # embedding (already ingested, column left untouched) go separately
+        with_embedding = []
+        without_embedding = []
+        for product_dict in product_dicts:
+            if product_dict["embedding"] is None:
+                # Drop the key so the upsert keeps the stored embedding
+                del product_dict["embedding"]
+                without_embedding.append(product_dict)
+            else:
+                product_dict["embedding"] = self._format_embedding(product_dict["embedding"])
+                with_embedding.append(product_dict)
+
+        for product_dicts in (with_embedding, without_embedding):
+            self._upsert_chunked(product_dicts, results)
 
+        return results
+
+    def _upsert_chunked(self, product_dicts: List[Dict[str, Any]], results: Dict[str, int]):
+        """One upsert per chunk instead of one HTTP round-trip per row"""
+        for i in range(0, len(product_dicts), self.CHUNK_SIZE):
+            chunk = product_dicts[i:i + self.CHUNK_SIZE]
+            try:
                 # Upsert using the unique constraint on (source, product_url)
+                response = self.client.table("products").upsert(
+                    chunk,
+                    on_conflict="source,product_url"
+                ).execute()
+
+                inserted = len(response.data) if response.data else 0
+                results["inserted"] += inserted
+                results["errors"] += len(chunk) - inserted
+                logger.info(f"Upserted {inserted}/{len(chunk)} products in chunk {i // self.CHUNK_SIZE + 1}")
+
+            except Exception as e:
+                logger.error(f"Bulk upsert failed for chunk starting at {i}, "
+                             f"retrying rows individually: {e}")
+                self._import_individually(chunk, results)
+
+    def _import_individually(self, product_dicts: List[Dict[str, Any]], results: Dict[str, int]):
+        """Fallback for a failed chunk: upsert row by row to isolate bad rows"""
+        for product_dict in product_dicts:
+            try:
                 response = self.client.table("products").upsert(
                     product_dict,
                     on_conflict="source,product_url"
@@ -258,49 +603,130 @@ class SupabaseImporter:
 
                 if response.data:
                     results["inserted"] += 1
-                    logger.info(f"Inserted/Updated product: {product.title}")
                 else:
                     results["errors"] += 1
-                    logger.error(f"Failed to insert product: {product.title}")
+                    logger.error(f"Failed to insert product: {product_dict['id']}")
 
             except Exception as e:
                 results["errors"] += 1
-                logger.error(f"Error importing product {product.id}: {e}")
-
-        return results
+                logger.error(f"Error importing product {product_dict['id']}: {e}")
+
+    # Row columns sent to Supabase, in ProductData attribute order
+    COLUMNS = (
+        "id", "source", "product_url", "affiliate_url", "image_url", "brand",
+        "title", "description", "category", "gender", "price", "currency",
+        "metadata", "size", "second_hand", "embedding", "country",
+        "compressed_image_url", "tags"
+    )
+
+    @staticmethod
+    def _format_embedding(embedding: List[float]) -> str:
+        """Serialize an embedding as a compact pgvector literal.
+
+        pgvector parses "[x,y,...]" natively, and 6 significant digits covers
+        float32 precision - roughly half the payload bytes of the float64
+        values JSON serialization would send.
+        """
+        return f"[{','.join(f'{x:.6g}' for x in embedding)}]"
+
+    def _products_to_dicts(self, products: List[ProductData]) -> List[Dict[str, Any]]:
+        """Convert products to row dicts via a columnar (SoA) build.
+
+        One attribute-lookup pass per column instead of one dict literal per
+        row keeps the serialization loop tight for large batches.
+        """
+        columns = {name: [getattr(product, name) for product in products]
+                   for name in self.COLUMNS}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
 
 class COSScraper:
     """Main scraper class"""
 
+    # Browser-like headers used for all COS API requests
+    REQUEST_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'application/json, text/plain, */*',
+        'Accept-Language': 'en-GB,en-US;q=0.9,en;q=0.8',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+        'Sec-Fetch-Dest': 'empty',
+        'Sec-Fetch-Mode': 'cors',
+        'Sec-Fetch-Site': 'same-origin',
+        'Cache-Control': 'max-age=0',
+        'sec-ch-ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
+        'sec-ch-ua-mobile': '?0',
+        'sec-ch-ua-platform': '"Windows"',
+        'Referer': 'https://www.cos.com/en-eu/',
+        'Origin': 'https://www.cos.com',
+        'X-Requested-With': 'XMLHttpRequest',
+    }
+
     def __init__(self, supabase_url: str, supabase_key: str):
         self.processor = COSDataProcessor()
         self.importer = SupabaseImporter(supabase_url, supabase_key)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Create the shared HTTP session on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.REQUEST_HEADERS,
+                connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+            )
+        return self._session
+
+    async def aclose(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     def load_json_from_file(self, file_path: str) -> Dict[str, Any]:
         """Load JSON data from file"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
 
-    def scrape_from_json_file(self, json_file_path: str, limit: Optional[int] = None) -> Dict[str, int]:
-        """Scrape products from JSON file and import to Supabase"""
-        logger.info(f"Loading products from file: {json_file_path}")
+    def _fetch_existing(self, json_data: Dict[str, Any]) -> Dict[str, str]:
+        """Look up which of the candidate products are already in the database"""
+        ids = [f"cos_{item['id']}" for item in json_data.get("items", []) if item.get("id")]
+        return self.importer.fetch_existing(ids) if ids else {}
 
-        # Load JSON data
-        json_data = self.load_json_from_file(json_file_path)
+    # Products per embed + import round; keeps peak memory O(chunk), not O(catalog)
+    IMPORT_CHUNK_SIZE = 512
 
-        # Process products
-        products = self.processor.process_json_response(json_data)
+    def process_and_import(self, json_data: Dict[str, Any],
+                           limit: Optional[int] = None) -> Dict[str, int]:
+        """Stream products through embedding and import in chunks"""
+        totals = {"inserted": 0, "updated": 0, "errors": 0}
+        existing = self._fetch_existing(json_data)
 
+        iterator = self.processor.iter_products(json_data)
         if limit:
-            products = products[:limit]
+            iterator = islice(iterator, limit)
             logger.info(f"Limited to first {limit} products for testing")
 
-        logger.info(f"Processed {len(products)} products successfully")
+        processed = 0
+        for chunk in _chunked(iterator, self.IMPORT_CHUNK_SIZE):
+            self.processor.attach_embeddings(chunk, existing)
+            results = self.importer.import_products(chunk)
+            for key in totals:
+                totals[key] += results.get(key, 0)
+            processed += len(chunk)
 
-        # Import to Supabase
-        results = self.importer.import_products(products)
+        logger.info(f"Processed {processed} products successfully")
+        return totals
 
-        return results
+    def scrape_from_json_file(self, json_file_path: str, limit: Optional[int] = None) -> Dict[str, int]:
+        """Scrape products from JSON file and import to Supabase"""
+        logger.info(f"Loading products from file: {json_file_path}")
+
+        # Load JSON data
+        json_data = self.load_json_from_file(json_file_path)
+
+        # Stream through embedding + import, chunk by chunk
+        return self.process_and_import(json_data, limit)
 
     async def scrape_from_json_url(self, json_url: str, limit: Optional[int] = None) -> Dict[str, int]:
         """Scrape products from JSON URL and import to Supabase"""
@@ -309,42 +735,11 @@ class COSScraper:
         # Fetch JSON data from URL
         json_data = await self.fetch_json_from_url(json_url)
 
-        # Process products
-        products = self.processor.process_json_response(json_data)
-
-        if limit:
-            products = products[:limit]
-            logger.info(f"Limited to first {limit} products for testing")
-
-        logger.info(f"Processed {len(products)} products successfully")
-
-        # Import to Supabase
-        results = self.importer.import_products(products)
-
-        return results
+        # Stream through embedding + import, chunk by chunk
+        return self.process_and_import(json_data, limit)
 
     async def fetch_json_from_url(self, url: str, max_retries: int = 3) -> Dict[str, Any]:
         """Fetch JSON data from URL with comprehensive headers and retry logic"""
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'application/json, text/plain, */*',
-            'Accept-Language': 'en-GB,en-US;q=0.9,en;q=0.8',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'empty',
-            'Sec-Fetch-Mode': 'cors',
-            'Sec-Fetch-Site': 'same-origin',
-            'Cache-Control': 'max-age=0',
-            'sec-ch-ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"',
-            'Referer': 'https://www.cos.com/en-eu/',
-            'Origin': 'https://www.cos.com',
-            'X-Requested-With': 'XMLHttpRequest',
-        }
-
         for attempt in range(max_retries):
             try:
                 # Add delay between requests (exponential backoff)
@@ -356,14 +751,14 @@ class COSScraper:
                 # Add some delay to avoid rate limiting
                 await asyncio.sleep(1)
 
-                async with aiohttp.ClientSession(headers=headers) as session:
-                    async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                        logger.info(f"Response status: {response.status}")
-                        logger.info(f"Response headers: {dict(response.headers)}")
+                session = await self._get_session()
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                    logger.info(f"Response status: {response.status}")
+                    logger.info(f"Response headers: {dict(response.headers)}")
 
-                        response.raise_for_status()
-                        json_data = await response.json()
-                        return json_data
+                    response.raise_for_status()
+                    json_data = orjson.loads(await response.read())
+                    return json_data
 
             except Exception as e:
                 logger.error(f"Attempt {attempt + 1} failed for {url}: {e}")
@@ -376,25 +771,25 @@ class COSScraper:
         """Scrape products from API endpoint"""
         logger.info(f"Fetching products from {api_url}")
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(api_url) as response:
-                    response.raise_for_status()
-                    json_data = await response.json()
+        try:
+            session = await self._get_session()
+            async with session.get(api_url) as response:
+                response.raise_for_status()
+                json_data = orjson.loads(await response.read())
 
-                    # Process products
-                    products = self.processor.process_json_response(json_data)
+                # Process products
+                products = self.processor.process_json_response(json_data)
 
-                    logger.info(f"Processed {len(products)} products successfully")
+                logger.info(f"Processed {len(products)} products successfully")
 
-                    # Import to Supabase
-                    results = self.importer.import_products(products)
+                # Import to Supabase
+                results = self.importer.import_products(products)
 
-                    return results
+                return results
 
-            except Exception as e:
-                logger.error(f"Failed to fetch from API: {e}")
-                return {"inserted": 0, "updated": 0, "errors": 1}
+        except Exception as e:
+            logger.error(f"Failed to fetch from API: {e}")
+            return {"inserted": 0, "updated": 0, "errors": 1}
 
 
 class COSBrowserScraper:
@@ -531,61 +926,64 @@ class COSBrowserScraper:
                 logger.info(f"Waiting {delay} seconds before retry...")
                 await asyncio.sleep(delay)
 
-    async def scrape_from_browser_url(self, url: str, limit: Optional[int] = None) -> Dict[str, int]:
-        """Scrape products from URL using browser with automatic pagination"""
-        try:
-            all_products = []
-            start_index = 0
-            view_size = 30  # Default page size
+    async def collect_items_from_url(self, url: str) -> List[Dict[str, Any]]:
+        """Fetch all raw product items from a URL with automatic pagination"""
+        all_items = []
+        start_index = 0
+        view_size = 30  # Default page size
 
-            # Extract view_size from URL if present
-            import re
-            view_size_match = re.search(r'viewSize=(\d+)', url)
-            if view_size_match:
-                view_size = int(view_size_match.group(1))
+        # Extract view_size from URL if present
+        view_size_match = re.search(r'viewSize=(\d+)', url)
+        if view_size_match:
+            view_size = int(view_size_match.group(1))
 
-            logger.info(f"Starting pagination scrape with view_size={view_size}")
+        logger.info(f"Starting pagination scrape with view_size={view_size}")
 
-            while True:
-                # Modify URL with current start_index
-                current_url = re.sub(r'startIndex=\d+', f'startIndex={start_index}', url)
+        while True:
+            # Modify URL with current start_index
+            current_url = re.sub(r'startIndex=\d+', f'startIndex={start_index}', url)
 
-                logger.info(f"Fetching page with startIndex={start_index} (URL: {current_url})")
+            logger.info(f"Fetching page with startIndex={start_index} (URL: {current_url})")
 
-                # Fetch JSON data using browser
-                json_data = await self.fetch_json_with_browser(current_url)
+            # Fetch JSON data using browser
+            json_data = await self.fetch_json_with_browser(current_url)
 
-                # Process products from this page
-                products = self.processor.process_json_response(json_data)
+            items = json_data.get("items", [])
+            if not items:
+                logger.info(f"No more products found at startIndex={start_index}, ending pagination")
+                break
+
+            logger.info(f"Found {len(items)} products on this page")
+            all_items.extend(items)
 
-                if not products:
-                    logger.info(f"No more products found at startIndex={start_index}, ending pagination")
-                    break
+            # Check if we got fewer products than expected (last page)
+            if len(items) < view_size:
+                logger.info(f"Received {len(items)} products (< {view_size}), this appears to be the last page")
+                break
 
-                logger.info(f"Found {len(products)} products on this page")
-                all_products.extend(products)
+            # Move to next page
+            start_index += view_size
 
-                # Check if we got fewer products than expected (last page)
-                if len(products) < view_size:
-                    logger.info(f"Received {len(products)} products (< {view_size}), this appears to be the last page")
-                    break
+            # Add delay between pages to be respectful
+            await asyncio.sleep(random.uniform(3, 7))
 
-                # Move to next page
-                start_index += view_size
+        logger.info(f"Pagination complete! Collected {len(all_items)} items total")
+        return all_items
 
-                # Add delay between pages to be respectful
-                await asyncio.sleep(random.uniform(3, 7))
+    async def scrape_from_browser_url(self, url: str, limit: Optional[int] = None) -> Dict[str, int]:
+        """Scrape products from URL using browser with automatic pagination"""
+        try:
+            items = await self.collect_items_from_url(url)
+            products = self.processor.process_json_response({"items": items})
 
             # Apply global limit if specified
             if limit:
-                all_products = all_products[:limit]
+                products = products[:limit]
                 logger.info(f"Applied global limit: {limit} products total")
 
-            logger.info(f"Pagination complete! Processed {len(all_products)} products total")
-
             # Import all products to Supabase
-            if all_products:
-                results = self.importer.import_products(all_products)
+            if products:
+                results = self.importer.import_products(products)
                 return results
             else:
                 return {"inserted": 0, "updated": 0, "errors": 0}
@@ -701,25 +1099,49 @@ def main():
                     logger.error(f"Failed to process file {file_path}: {e}")
                     total_results["errors"] += 1
 
-            # Multiple URLs from config or single URL (using browser to bypass bot detection)
+            # Multiple URLs from config or single URL - fetch all of them
+            # concurrently, then process and import the pooled items once
             if urls_to_scrape:
-                logger.info("Initializing browser scraper for URL processing...")
-                async with COSBrowserScraper(SUPABASE_URL, SUPABASE_KEY) as browser_scraper:
-                    for i, url in enumerate(urls_to_scrape, 1):
-                        logger.info(f"Processing URL {i}/{len(urls_to_scrape)}: {url}")
-                        try:
-                            results = await browser_scraper.scrape_from_browser_url(url, limit)
-                            total_results["inserted"] += results["inserted"]
-                            total_results["updated"] += results["updated"]
-                            total_results["errors"] += results["errors"]
-
-                            # Add delay between URLs to avoid overwhelming the server
-                            if i < len(urls_to_scrape):
-                                await asyncio.sleep(random.uniform(5, 10))
-
-                        except Exception as e:
-                            logger.error(f"Failed to process URL {url}: {e}")
-                            total_results["errors"] += 1
+                logger.info(f"Fetching {len(urls_to_scrape)} URLs concurrently...")
+                json_blobs = await asyncio.gather(
+                    *(scraper.fetch_json_from_url(url) for url in urls_to_scrape),
+                    return_exceptions=True
+                )
+
+                all_items = []
+                failed_urls = []
+                for url, blob in zip(urls_to_scrape, json_blobs):
+                    if isinstance(blob, BaseException):
+                        logger.warning(f"Direct fetch failed for {url}, will retry with browser: {blob}")
+                        failed_urls.append(url)
+                    else:
+                        all_items.extend(blob.get("items", []))
+
+                # Fall back to browser automation for URLs that hit bot detection
+                if failed_urls:
+                    logger.info("Initializing browser scraper for blocked URLs...")
+                    async with COSBrowserScraper(SUPABASE_URL, SUPABASE_KEY) as browser_scraper:
+                        for i, url in enumerate(failed_urls, 1):
+                            logger.info(f"Processing URL {i}/{len(failed_urls)}: {url}")
+                            try:
+                                all_items.extend(await browser_scraper.collect_items_from_url(url))
+
+                                # Add delay between URLs to avoid overwhelming the server
+                                if i < len(failed_urls):
+                                    await asyncio.sleep(random.uniform(5, 10))
+
+                            except Exception as e:
+                                logger.error(f"Failed to process URL {url}: {e}")
+                                total_results["errors"] += 1
+
+                # One streamed processing + import pass over the pooled items
+                if all_items:
+                    results = scraper.process_and_import({"items": all_items}, limit)
+                    total_results["inserted"] += results["inserted"]
+                    total_results["updated"] += results["updated"]
+                    total_results["errors"] += results["errors"]
+
+        await scraper.aclose()
 
         logger.info("Scraping completed!")
         logger.info(f"Total Results: {total_results}")